@@ -1,12 +1,35 @@
-from datetime import time
+import functools
+import io
 import os
 import sys
-import arcpy
+import numpy as np
 import pandas as pd
 from arcgis.features import GeoAccessor,GeoSeriesAccessor
-from arcgis.geometry import find_transformation, Geometry, SpatialReference
-import multiprocessing
-from multiprocessing.pool import ThreadPool
+from arcgis.geometry import Geometry, SpatialReference
+from multiprocessing import Pool, cpu_count, set_executable
+
+try:
+    import pyproj
+except ImportError:
+    pyproj = None
+
+try:
+    import shapely
+except ImportError:
+    shapely = None
+
+#the vectorized dwithin query needs shapely 2 built against GEOS 3.10 or later
+_HAS_SHAPELY2 = (shapely is not None and int(shapely.__version__.split('.')[0]) >= 2 and
+                 shapely.geos_version >= (3,10,0))
+
+try:
+    from numba import njit
+except ImportError:
+    def njit(*args, **kwargs):
+        '''Stand in for numba.njit that leaves the kernels as plain python'''
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda func: func
 
 def spaceTimeMatch(detectionFeatureClass, detectionIDField, detectionTimeField, tracksFeatureClass, trackIDField, trackTimeField, distanceTolerance=800):
     """Conducts a space time match of detections and associated track datas.
@@ -14,7 +37,7 @@ def spaceTimeMatch(detectionFeatureClass, detectionIDField, detectionTimeField,
     Parameters
     ----------
     detectionFeatureClass : str
-        path to polygon featureclass of detections
+        path to polygon featureclass or GeoParquet file of detections
         
     detectionIDField : str
         unique id field of detections
@@ -23,7 +46,7 @@ def spaceTimeMatch(detectionFeatureClass, detectionIDField, detectionTimeField,
         field containing time of detection
         
     tracksFeatureClass : str
-        path to point featureclass of points representing tracks in the area of interst
+        path to point featureclass or GeoParquet file of points representing tracks in the area of interst
         
     trackIDField : str
         unique id field of tracks
@@ -36,46 +59,637 @@ def spaceTimeMatch(detectionFeatureClass, detectionIDField, detectionTimeField,
 
     Returns
     -------
-    list of spatially enabled dataframes of tracks that match a detection in space and time. The 
-    unique ID of the matched detection is stored in the column "detection_oid"
+    spatially enabled dataframe of the points of the tracks that match a detection in space and time,
+    holding every attribute of the tracks and the point geometry in 3857. The unique ID of the matched
+    detection is stored in the column "detection_oid"
     """
-    sdf = pd.DataFrame.spatial.from_featureclass(tracksFeatureClass) #get sdf of track points
-    sdf = project_as(sdf,3857)
-
-    unique_tracks = _getUniqueTrackDFs(sdf,trackIDField)
-    del sdf
-
-    aoi_df = pd.DataFrame.spatial.from_featureclass(detectionFeatureClass)
-    aoi_df = project_as(aoi_df,3857)
-    aoi_df['SHAPE'] = aoi_df['SHAPE'].geom.buffer(distanceTolerance) #buffer all polygons to the search distance
-
-    detection_candidates = []
-    def worker(sdf):
-        '''Worker function to distribute space time matching'''
-        sdf.drop_duplicates(subset=[trackTimeField],inplace=True) #sort df by time to make sure tracks are processed in logical order
-        sdf.sort_values(by=[trackTimeField],inplace=True)
-        sdf = sdf.reset_index(drop=True)
-        num_points = len(sdf.index)
-
-        for ind,row in aoi_df.iterrows():
-            timestamp = row[detectionTimeField]
-            aoi = arcpy.AsShape(row['SHAPE'],True)
-
-            current_point = arcpy.AsShape(sdf['SHAPE'].iloc[0],True)
-            next_point = None
-            
-            for i in range(0,num_points-1):             
-                next_point = arcpy.AsShape(sdf['SHAPE'].iloc[i+1],True)
-                line = arcpy.Polyline(arcpy.Array(items=[current_point.firstPoint,next_point.firstPoint]),3857)
-                if aoi.disjoint(line) is False:
-                    if (sdf[trackTimeField].iloc[i] < timestamp) and (sdf[trackTimeField].iloc[i+1] > timestamp):
-                        sdf['detection_oid'] = row[detectionIDField]
-                        detection_candidates.append(sdf)
-                        return True
-            
-    _executeMultiprocessTask(worker,unique_tracks,'Evaluating track ')
-
-    return detection_candidates
+    df = _readTrackPoints(tracksFeatureClass,trackIDField,trackTimeField,3857) #get df of track points
+
+    unique_tracks = _getUniqueTrackDFs(df,trackIDField)
+
+    aois = _getDetectionArrays(detectionFeatureClass,detectionIDField,detectionTimeField,distanceTolerance,3857) #convert the aois once, the workers only receive arrays
+
+    worker = functools.partial(_matchTracks,aois=aois,fields=(trackIDField,trackTimeField),distanceTolerance=distanceTolerance)
+
+    matches = []
+    for candidates in _executeMultiprocessTask(worker,unique_tracks,'Evaluating tracks '):
+        matches.extend(candidates)
+    del unique_tracks
+
+    #join the matches back onto the track points once all candidates are known
+    matches_df = pd.DataFrame(matches,columns=[trackIDField,'detection_oid'])
+    df = df.merge(matches_df,on=trackIDField)
+
+    order = _uniqueTrackPointOrder(pd.factorize(df[trackIDField])[0],df[trackTimeField].to_numpy())
+    df = df.iloc[order].reset_index(drop=True)
+
+    #only the matched points read the remaining track attributes, so the output keeps the schema of the tracks
+    attributes = _readTrackAttributes(tracksFeatureClass,df['OID@'].to_numpy())
+    df = attributes.merge(df[['OID@','detection_oid','SHAPE@X','SHAPE@Y']],on='OID@',how='right')
+
+    if len(df):
+        sdf = pd.DataFrame.spatial.from_xy(df,'SHAPE@X','SHAPE@Y',sr=3857)
+    else: #from_xy builds the points row by row, without matches only the empty geometry column is set
+        sdf = df.assign(SHAPE=pd.Series([],dtype=object))
+        sdf.spatial.set_geometry('SHAPE',sr=3857)
+    return sdf.drop(columns=['OID@','SHAPE@X','SHAPE@Y'])
+
+def _readTrackPoints(tracksFeatureClass, trackIDField, trackTimeField, wkid):
+    '''
+    Reads the id, time and coordinates of track points straight into numpy, skipping the
+    construction of geometry objects and of every other attribute. Points with a null id or
+    time are skipped.
+
+    Parameters
+    ----------
+    tracksFeatureClass : str
+        path to point featureclass or GeoParquet file of tracks
+
+    trackIDField : str
+        unique id field of tracks
+
+    trackTimeField : str
+        field containing time of each track point
+
+    wkid : int
+        well known id of the spatial reference to read the points in
+
+    Returns
+    -------
+    pandas dataframe with the key of each point in the column "OID@", the track id, time and
+    the x and y coordinates in the columns "SHAPE@X" and "SHAPE@Y"
+    '''
+    if _isGeoParquet(tracksFeatureClass):
+        gdf = _readGeoParquet(tracksFeatureClass,wkid)
+        df = pd.DataFrame({'OID@':np.arange(len(gdf)), #GeoParquet has no object ids, the row number is the key
+                           trackIDField:gdf[trackIDField].to_numpy(),
+                           trackTimeField:gdf[trackTimeField].to_numpy(),
+                           'SHAPE@X':gdf.geometry.x.to_numpy(),
+                           'SHAPE@Y':gdf.geometry.y.to_numpy()})
+        return df.dropna(subset=[trackIDField,trackTimeField]).reset_index(drop=True)
+
+    arcpy = _importArcpy()
+    in_sr = arcpy.Describe(tracksFeatureClass).spatialReference
+    out_sr = arcpy.SpatialReference(wkid)
+
+    #the projection happens during the read, with the same cached transformation lookup project_as uses
+    if in_sr.factoryCode:
+        in_sr = _spatial_reference(in_sr.factoryCode)
+    else: #custom spatial references have no wkid, the wkt is everything before the domain and tolerances
+        in_sr = SpatialReference({'wkt':in_sr.exportToString().split(';')[0]})
+    transformations = _list_transformations(in_sr,_spatial_reference(wkid))
+    with arcpy.EnvManager(geographicTransformations=list(transformations[:1])):
+        arr = arcpy.da.FeatureClassToNumPyArray(tracksFeatureClass,['OID@',trackIDField,trackTimeField,'SHAPE@XY'],
+                                                spatial_reference=out_sr,skip_nulls=True)
+
+    return pd.DataFrame({'OID@':arr['OID@'],
+                        trackIDField:arr[trackIDField],
+                        trackTimeField:arr[trackTimeField],
+                        'SHAPE@X':arr['SHAPE@XY'][:,0],
+                        'SHAPE@Y':arr['SHAPE@XY'][:,1]})
+
+def _readTrackAttributes(tracksFeatureClass, oids):
+    '''
+    Reads every attribute but the geometry of the given track points
+
+    Parameters
+    ----------
+    tracksFeatureClass : str
+        path to point featureclass or GeoParquet file of tracks
+
+    oids : numpy array
+        keys of the points to read, as returned by _readTrackPoints
+
+    Returns
+    -------
+    pandas dataframe of the attributes with the key of each point in the column "OID@"
+    '''
+    if _isGeoParquet(tracksFeatureClass):
+        gdf = _readGeoParquet(tracksFeatureClass)
+        df = pd.DataFrame(gdf.drop(columns=gdf.geometry.name)).iloc[oids].reset_index(drop=True)
+        df.insert(0,'OID@',oids)
+        return df
+
+    arcpy = _importArcpy()
+    fields = [field.name for field in arcpy.ListFields(tracksFeatureClass) if field.type != 'Geometry']
+    oidField = arcpy.AddFieldDelimiters(tracksFeatureClass,arcpy.Describe(tracksFeatureClass).OIDFieldName)
+
+    #the where clause keeps the filtering in the database, batched to stay under the IN list limits
+    rows = []
+    for start in range(0,len(oids),1000):
+        where = '{} IN ({})'.format(oidField,','.join(str(int(oid)) for oid in oids[start:start+1000]))
+        with arcpy.da.SearchCursor(tracksFeatureClass,['OID@',*fields],where_clause=where) as cursor:
+            rows.extend(cursor)
+    return pd.DataFrame.from_records(rows,columns=['OID@',*fields])
+
+def _getDetectionArrays(detectionFeatureClass, detectionIDField, detectionTimeField, distanceTolerance, wkid):
+    '''
+    Reads the detections into the plain arrays shipped to the matching workers
+
+    Parameters
+    ----------
+    detectionFeatureClass : str
+        path to polygon featureclass or GeoParquet file of detections
+
+    detectionIDField : str
+        unique id field of detections
+
+    detectionTimeField : str
+        field containing time of detection
+
+    distanceTolerance : int
+        search distance for tracks to intersect detections
+
+    wkid : int
+        well known id of the spatial reference to read the detections in
+
+    Returns
+    -------
+    dict of numpy arrays with the ids, times and bounding boxes grown by the search distance of
+    the detections. If every detection is an axis aligned rectangle it holds their xmin, ymin,
+    xmax, ymax, otherwise with shapely 2 the WKB of the polygons, otherwise the polygon edges
+    and the offset of the first edge of each polygon
+    '''
+    if _isGeoParquet(detectionFeatureClass):
+        aoi_df = _readGeoParquet(detectionFeatureClass,wkid)
+        geometries = aoi_df.geometry
+        bounds = geometries.bounds.to_numpy()
+        getWKB, getRings = (lambda geom: geom.wkb), _getShapelyRings
+    else:
+        aoi_df = pd.DataFrame.spatial.from_featureclass(detectionFeatureClass)
+        aoi_df = project_as(aoi_df,wkid)
+        geometries = aoi_df['SHAPE']
+        bounds = np.array([geom.extent for geom in geometries],dtype=np.float64)
+        getWKB, getRings = (lambda geom: geom.WKB), (lambda geom: geom['rings'])
+
+    aois = {'ids':aoi_df[detectionIDField].to_numpy(),
+            'times':aoi_df[detectionTimeField].to_numpy(),
+            'bounds':bounds.reshape(-1,4) + np.array([-1,-1,1,1])*distanceTolerance}
+
+    #the polygons are not buffered, the spatial tests measure the distance to them instead
+    rects = _getRectangles([getRings(geom) for geom in geometries])
+    if rects is not None:
+        aois['rects'] = rects
+    elif _HAS_SHAPELY2:
+        aois['wkb'] = np.array([getWKB(geom) for geom in geometries],dtype=object)
+    else:
+        aois['edges'], aois['offsets'] = _getPolygonEdges([getRings(geom) for geom in geometries])
+    return aois
+
+def _getRectangles(polygons):
+    '''
+    Gets the extent of each polygon if all of them are axis aligned rectangles, as most object
+    detection bounding boxes are
+
+    Parameters
+    ----------
+    polygons : list
+        closed rings of each polygon as lists of coordinates
+
+    Returns
+    -------
+    (N,4) float array of the xmin, ymin, xmax, ymax of each polygon, or None if any polygon is
+    not an axis aligned rectangle
+    '''
+    rects = []
+    for polygon in polygons:
+        if len(polygon) != 1 or len(polygon[0]) != 5:
+            return None
+        ring = np.asarray(polygon[0],dtype=np.float64)[:,:2]
+        dx, dy = np.diff(ring,axis=0).T
+        if not np.array_equal(ring[0],ring[-1]) or not np.all((dx == 0) != (dy == 0)): #every edge is horizontal or vertical
+            return None
+        rects.append([ring[:,0].min(),ring[:,1].min(),ring[:,0].max(),ring[:,1].max()])
+
+    return np.array(rects,dtype=np.float64) if rects else None
+
+def _getShapelyRings(geom):
+    '''Gets the exterior and interior rings of a shapely polygon or multipolygon as coordinate arrays'''
+    polygons = geom.geoms if hasattr(geom,'geoms') else [geom]
+    return [np.asarray(ring.coords) for poly in polygons for ring in [poly.exterior,*poly.interiors]]
+
+def _getPolygonEdges(polygons):
+    '''
+    Flattens the rings of polygons into one array of edges
+
+    Parameters
+    ----------
+    polygons : list
+        closed rings of each polygon as lists of coordinates
+
+    Returns
+    -------
+    tuple of a (E,2,2) float array of the edges of all polygons and an array with the offset
+    of the first edge of each polygon, the edges of polygon i are edges[offsets[i]:offsets[i+1]]
+    '''
+    edges = [np.zeros((0,2,2))]
+    counts = []
+    for polygon in polygons:
+        rings = [np.asarray(ring,dtype=np.float64)[:,:2] for ring in polygon] #rings are closed, drop any z or m values
+        geom_edges = [np.stack([ring[:-1],ring[1:]],axis=1) for ring in rings]
+        edges.extend(geom_edges)
+        counts.append(sum(len(ring_edges) for ring_edges in geom_edges))
+
+    return np.concatenate(edges), np.concatenate([[0],np.cumsum(counts,dtype=np.int64)])
+
+def _matchTracks(tracks, aois, fields, distanceTolerance):
+    '''
+    Worker function to distribute space time matching across a chunk of tracks
+
+    Parameters
+    ----------
+    tracks : list of pandas dataframes
+        tracks to be matched with one track per df
+
+    aois : dict of numpy arrays
+        detections to match the tracks against, see _getDetectionArrays
+
+    fields : tuple of str
+        track id and track time field names
+
+    distanceTolerance : int
+        search distance for tracks to intersect detections
+
+    Returns
+    -------
+    list of (track id, detection id) tuples for the tracks that match a detection
+    '''
+    trackIDField, trackTimeField = fields
+    aoi_ids, aoi_times = aois['ids'], aois['times']
+    if not len(aoi_ids):
+        return []
+
+    #pull the columns out once, everything below works on plain numpy arrays
+    track_codes = np.concatenate([np.full(len(df),code) for code, df in enumerate(tracks)]) #integer code of the track each point belongs to
+    times = np.concatenate([df[trackTimeField].to_numpy() for df in tracks])
+    xy = np.concatenate([df[['SHAPE@X','SHAPE@Y']].to_numpy(dtype=np.float64) for df in tracks])
+
+    #sort by track and time with duplicate times dropped so consecutive points form the segments of each track
+    order = _uniqueTrackPointOrder(track_codes,times)
+    track_codes, times, xy = track_codes[order], times[order], xy[order]
+
+    seg_start = _getTrackSegments(track_codes,times,xy,aoi_times,aois['bounds'])
+
+    #pair the segments with the grown bounding boxes they overlap, keeping the pairs where the detection time
+    #lies strictly between the start and end time of the segment
+    aoi_idx, point_idx = _getBoundsCandidates(seg_start,xy,aois['bounds'])
+    timestamps = aoi_times[aoi_idx]
+    in_time = (times[point_idx] < timestamps) & (times[point_idx+1] > timestamps)
+    aoi_idx, point_idx = aoi_idx[in_time], point_idx[in_time]
+
+    #only the remaining pairs get the exact distance test
+    if 'rects' in aois:
+        hits = _intersectSegmentsRects(aoi_idx,point_idx,xy,aois,distanceTolerance)
+    elif _HAS_SHAPELY2:
+        hits = _intersectSegmentsShapely(aoi_idx,point_idx,xy,aois,distanceTolerance)
+    else:
+        hits = _intersectSegmentsKernel(aoi_idx,point_idx,xy,aois,distanceTolerance)
+    aoi_idx, point_idx = aoi_idx[hits], point_idx[hits]
+
+    #a track is matched to the first detection it passes through
+    order = np.lexsort((aoi_idx,track_codes[point_idx]))
+    _, first = np.unique(track_codes[point_idx][order],return_index=True)
+    matched_points = point_idx[order][first]
+    matched_aois = aoi_idx[order][first]
+
+    track_ids = [tracks[code][trackIDField].iat[0] for code in track_codes[matched_points]]
+    return list(zip(track_ids,aoi_ids[matched_aois]))
+
+def _getBoundsCandidates(seg_start, xy, bounds):
+    '''
+    Pairs every detection with the segments overlapping its grown bounding box
+
+    Parameters
+    ----------
+    seg_start : numpy array
+        index of the first point of each segment
+
+    xy : numpy array
+        (N,2) float array of the point coordinates
+
+    bounds : numpy array
+        (N,4) array of the xmin, ymin, xmax, ymax of each detection grown by the search distance
+
+    Returns
+    -------
+    tuple of the detection index and first point index of every candidate pair
+    '''
+    if _HAS_SHAPELY2:
+        #the rtree only compares the envelopes of the segments with the boxes
+        seg_geoms = shapely.linestrings(np.stack([xy[seg_start],xy[seg_start+1]],axis=1)) #builds every LineString in a single call
+        aoi_idx, seg_idx = shapely.STRtree(seg_geoms).query(shapely.box(*bounds.T))
+        return aoi_idx, seg_start[seg_idx]
+
+    #without shapely 2 each box is compared with the bounding boxes of all segments
+    x0, y0 = xy[seg_start,0], xy[seg_start,1]
+    x1, y1 = xy[seg_start+1,0], xy[seg_start+1,1]
+    seg_xmin, seg_xmax = np.minimum(x0,x1), np.maximum(x0,x1)
+    seg_ymin, seg_ymax = np.minimum(y0,y1), np.maximum(y0,y1)
+
+    aoi_idx = [np.zeros(0,dtype=np.int64)]
+    point_idx = [np.zeros(0,dtype=np.int64)]
+    for ind, (xmin, ymin, xmax, ymax) in enumerate(bounds):
+        candidates = seg_start[(seg_xmin <= xmax) & (seg_xmax >= xmin) & (seg_ymin <= ymax) & (seg_ymax >= ymin)]
+        aoi_idx.append(np.full(len(candidates),ind,dtype=np.int64))
+        point_idx.append(candidates)
+
+    return np.concatenate(aoi_idx), np.concatenate(point_idx)
+
+def _intersectSegmentsShapely(aoi_idx, point_idx, xy, aois, distanceTolerance):
+    '''
+    Tests which candidate pairs of segments and detections lie within the search distance
+    with shapely
+
+    Parameters
+    ----------
+    aoi_idx : numpy array
+        detection index of each pair
+
+    point_idx : numpy array
+        index of the first point of the segment of each pair
+
+    xy : numpy array
+        (N,2) float array of the point coordinates
+
+    aois : dict of numpy arrays
+        detections to match the segments against, see _getDetectionArrays
+
+    distanceTolerance : int
+        search distance for tracks to intersect detections
+
+    Returns
+    -------
+    boolean array, true for the pairs within the search distance
+    '''
+    aoi_geoms = shapely.from_wkb(aois['wkb'])
+    shapely.prepare(aoi_geoms) #index the polygon edges once so every candidate segment is tested against the prepared aoi
+    seg_geoms = shapely.linestrings(np.stack([xy[point_idx],xy[point_idx+1]],axis=1))
+    return shapely.dwithin(aoi_geoms[aoi_idx],seg_geoms,distanceTolerance)
+
+def _intersectSegmentsRects(aoi_idx, point_idx, xy, aois, distanceTolerance):
+    '''
+    Tests which candidate pairs of segments and rectangular detections lie within the search
+    distance with the compiled _segmentsNearRects kernel
+
+    Parameters
+    ----------
+    aoi_idx : numpy array
+        detection index of each pair
+
+    point_idx : numpy array
+        index of the first point of the segment of each pair
+
+    xy : numpy array
+        (N,2) float array of the point coordinates
+
+    aois : dict of numpy arrays
+        detections to match the segments against, see _getDetectionArrays
+
+    distanceTolerance : int
+        search distance for tracks to intersect detections
+
+    Returns
+    -------
+    boolean array, true for the pairs within the search distance
+    '''
+    hits = np.zeros(len(point_idx),dtype=np.bool_)
+    _segmentsNearRects(np.stack([xy[point_idx],xy[point_idx+1]],axis=1),aois['rects'][aoi_idx],
+                       float(distanceTolerance),hits)
+    return hits
+
+def _intersectSegmentsKernel(aoi_idx, point_idx, xy, aois, distanceTolerance):
+    '''
+    Tests which candidate pairs of segments and detections lie within the search distance
+    with the compiled _segmentsNearPolygon kernel, used when shapely 2 is not available
+
+    Parameters
+    ----------
+    aoi_idx : numpy array
+        detection index of each pair
+
+    point_idx : numpy array
+        index of the first point of the segment of each pair
+
+    xy : numpy array
+        (N,2) float array of the point coordinates
+
+    aois : dict of numpy arrays
+        detections to match the segments against, see _getDetectionArrays
+
+    distanceTolerance : int
+        search distance for tracks to intersect detections
+
+    Returns
+    -------
+    boolean array, true for the pairs within the search distance
+    '''
+    hits = np.zeros(len(point_idx),dtype=np.bool_)
+    if not len(point_idx):
+        return hits
+
+    #group the pairs by detection so each kernel call tests the edges of one polygon
+    order = np.argsort(aoi_idx,kind='stable')
+    sorted_aois = aoi_idx[order]
+    bounds = np.flatnonzero(np.concatenate([[True],sorted_aois[1:] != sorted_aois[:-1],[True]]))
+    edges, offsets = aois['edges'], aois['offsets']
+    for start, end in zip(bounds[:-1],bounds[1:]):
+        ind, pairs = sorted_aois[start], order[start:end]
+        group_hits = np.zeros(len(pairs),dtype=np.bool_)
+        _segmentsNearPolygon(np.stack([xy[point_idx[pairs]],xy[point_idx[pairs]+1]],axis=1),
+                             edges[offsets[ind]:offsets[ind+1]],float(distanceTolerance),group_hits)
+        hits[pairs] = group_hits
+
+    return hits
+
+#the kernels run inside every pool worker, so they are cached to disk rather than compiled per process
+#and stay single threaded since the pool already uses every core
+@njit(cache=True)
+def _pointSegmentDistance(px, py, ax, ay, bx, by):
+    '''Distance from point p to segment ab'''
+    dx, dy = bx - ax, by - ay
+    length = dx*dx + dy*dy
+    t = 0.0
+    if length > 0.0:
+        t = min(1.0,max(0.0,((px - ax)*dx + (py - ay)*dy)/length))
+    ex, ey = ax + t*dx - px, ay + t*dy - py
+    return np.sqrt(ex*ex + ey*ey)
+
+@njit(cache=True)
+def _segmentDistance(ax, ay, bx, by, cx, cy, dx, dy):
+    '''Distance between segments ab and cd, zero if they cross'''
+    d1 = (dx - cx)*(ay - cy) - (dy - cy)*(ax - cx)
+    d2 = (dx - cx)*(by - cy) - (dy - cy)*(bx - cx)
+    d3 = (bx - ax)*(cy - ay) - (by - ay)*(cx - ax)
+    d4 = (bx - ax)*(dy - ay) - (by - ay)*(dx - ax)
+    if d1*d2 < 0.0 and d3*d4 < 0.0:
+        return 0.0
+    return min(min(_pointSegmentDistance(ax,ay,cx,cy,dx,dy),_pointSegmentDistance(bx,by,cx,cy,dx,dy)),
+               min(_pointSegmentDistance(cx,cy,ax,ay,bx,by),_pointSegmentDistance(dx,dy,ax,ay,bx,by)))
+
+@njit(cache=True)
+def _segmentCrossesRect(ax, ay, bx, by, xmin, ymin, xmax, ymax):
+    '''Liang-Barsky clip of segment ab against an axis aligned rectangle, true if any part remains'''
+    dx, dy = bx - ax, by - ay
+    t0, t1 = 0.0, 1.0
+    for p, q in ((-dx,ax - xmin),(dx,xmax - ax),(-dy,ay - ymin),(dy,ymax - ay)):
+        if p == 0.0:
+            if q < 0.0: #parallel to and outside this edge
+                return False
+        else:
+            r = q/p
+            if p < 0.0:
+                if r > t1:
+                    return False
+                t0 = max(t0,r)
+            else:
+                if r < t0:
+                    return False
+                t1 = min(t1,r)
+    return True
+
+@njit(cache=True,fastmath=True)
+def _segmentsNearRects(seg_xy, rects, tolerance, out):
+    '''
+    Tests which segments lie within a distance of their paired axis aligned rectangle, about
+    a dozen comparisons per pair instead of a general polygon test
+
+    Parameters
+    ----------
+    seg_xy : numpy array
+        (K,2,2) float array of the segment end points
+
+    rects : numpy array
+        (K,4) float array of the xmin, ymin, xmax, ymax of the rectangle paired with each segment
+
+    tolerance : float
+        search distance
+
+    out : numpy array
+        boolean array of length K receiving the result
+    '''
+    for i in range(seg_xy.shape[0]):
+        ax, ay, bx, by = seg_xy[i,0,0], seg_xy[i,0,1], seg_xy[i,1,0], seg_xy[i,1,1]
+        xmin, ymin, xmax, ymax = rects[i,0], rects[i,1], rects[i,2], rects[i,3]
+        if _segmentCrossesRect(ax,ay,bx,by,xmin,ymin,xmax,ymax):
+            out[i] = True
+            continue
+
+        #otherwise the closest points are an end point to the rectangle or a corner to the segment
+        ex, ey = max(xmin - ax,0.0,ax - xmax), max(ymin - ay,0.0,ay - ymax)
+        fx, fy = max(xmin - bx,0.0,bx - xmax), max(ymin - by,0.0,by - ymax)
+        distance = min(np.sqrt(ex*ex + ey*ey),np.sqrt(fx*fx + fy*fy))
+        distance = min(distance,_pointSegmentDistance(xmin,ymin,ax,ay,bx,by))
+        distance = min(distance,_pointSegmentDistance(xmin,ymax,ax,ay,bx,by))
+        distance = min(distance,_pointSegmentDistance(xmax,ymin,ax,ay,bx,by))
+        distance = min(distance,_pointSegmentDistance(xmax,ymax,ax,ay,bx,by))
+        out[i] = distance <= tolerance
+
+@njit(cache=True)
+def _pointInPolygon(px, py, edges):
+    '''Even-odd test of point p against all polygon edges, which handles holes and multipart polygons'''
+    inside = False
+    for j in range(edges.shape[0]):
+        x0, y0, x1, y1 = edges[j,0,0], edges[j,0,1], edges[j,1,0], edges[j,1,1]
+        if (y0 > py) != (y1 > py) and px < x0 + (py - y0)*(x1 - x0)/(y1 - y0):
+            inside = not inside
+    return inside
+
+@njit(cache=True,fastmath=True)
+def _segmentsNearPolygon(seg_xy, edges, tolerance, out):
+    '''
+    Tests which segments lie within a distance of a polygon, the same as intersecting the
+    polygon buffered by that distance
+
+    Parameters
+    ----------
+    seg_xy : numpy array
+        (M,2,2) float array of the segment end points
+
+    edges : numpy array
+        (E,2,2) float array of the polygon edges
+
+    tolerance : float
+        search distance
+
+    out : numpy array
+        boolean array of length M receiving the result
+    '''
+    for i in range(seg_xy.shape[0]):
+        ax, ay, bx, by = seg_xy[i,0,0], seg_xy[i,0,1], seg_xy[i,1,0], seg_xy[i,1,1]
+        hit = _pointInPolygon(ax,ay,edges)
+        j = 0
+        while not hit and j < edges.shape[0]:
+            hit = _segmentDistance(ax,ay,bx,by,edges[j,0,0],edges[j,0,1],edges[j,1,0],edges[j,1,1]) <= tolerance
+            j += 1
+        out[i] = hit
+
+def _uniqueTrackPointOrder(codes, times):
+    '''
+    Gets the order that sorts track points by track and time, keeping only the first point
+    of each track at a given time
+
+    Parameters
+    ----------
+    codes : numpy array
+        integer code of the track of each point
+
+    times : numpy array
+        time of each point
+
+    Returns
+    -------
+    numpy array of point indices
+    '''
+    order = np.lexsort((times,codes)) #stable, so the first of any duplicate points stays first
+    if not len(order):
+        return order
+    codes, times = codes[order], times[order]
+    keep = np.concatenate([[True],(codes[1:] != codes[:-1]) | (times[1:] != times[:-1])])
+    return order[keep]
+
+def _getTrackSegments(track_codes, times, xy, detection_times, detection_bounds):
+    '''
+    Finds the line segments between consecutive points of each track that could match a
+    detection. Segments whose time span contains no detection time or whose bounding box
+    falls outside the extent of the detections are dropped before any geometry is built.
+
+    Parameters
+    ----------
+    track_codes : numpy array
+        integer code of the track of each point, points are sorted by track and time
+
+    times : numpy array
+        time of each point
+
+    xy : numpy array
+        (N,2) float array of the point coordinates
+
+    detection_times : numpy array
+        time of each detection
+
+    detection_bounds : numpy array
+        (N,4) array of the xmin, ymin, xmax, ymax of each detection
+
+    Returns
+    -------
+    numpy array of the index of the first point of each segment
+    '''
+    seg_start = np.flatnonzero(track_codes[:-1] == track_codes[1:]) #consecutive points of the same track form a segment
+
+    #a segment can only match if a detection time lies strictly between its start and end time
+    detection_times = np.sort(detection_times)
+    t0 = np.searchsorted(detection_times,times[seg_start],side='right')
+    t1 = np.searchsorted(detection_times,times[seg_start+1],side='left')
+    seg_start = seg_start[t1 > t0]
+
+    #and only if its bounding box overlaps the extent of the detections
+    x0, y0 = xy[seg_start,0], xy[seg_start,1]
+    x1, y1 = xy[seg_start+1,0], xy[seg_start+1,1]
+    xmin, ymin = detection_bounds[:,:2].min(axis=0)
+    xmax, ymax = detection_bounds[:,2:].max(axis=0)
+    in_extent = ((np.minimum(x0,x1) <= xmax) & (np.maximum(x0,x1) >= xmin) &
+                 (np.minimum(y0,y1) <= ymax) & (np.maximum(y0,y1) >= ymin))
+    return seg_start[in_extent]
 
 def _getUniqueTrackDFs(sdf, trackIDField):
     '''
@@ -93,10 +707,17 @@ def _getUniqueTrackDFs(sdf, trackIDField):
     -------
     list of pandas dataframes with one track per df
     '''
-    unique_tracks = [] #gets list of tracks
-    for uid, df_uid in sdf.groupby(trackIDField):
-        unique_tracks.append(df_uid)
-    return unique_tracks
+    ids = sdf[trackIDField].to_numpy()
+    if not len(ids):
+        return []
+
+    #sort once so every track is a contiguous slice of the sorted df
+    order = np.argsort(ids,kind='stable')
+    ids = ids[order]
+    bounds = np.flatnonzero(np.concatenate([[True],ids[1:] != ids[:-1],[True]]))
+
+    sdf = sdf.iloc[order]
+    return [sdf.iloc[start:end] for start, end in zip(bounds[:-1],bounds[1:])]
 
 def _executeMultiprocessTask(workerFunction,uniqueData,progressorLabel):
     '''
@@ -105,24 +726,43 @@ def _executeMultiprocessTask(workerFunction,uniqueData,progressorLabel):
     Parameters
     ----------
     workerFunction : Function
-        A static function to be executed in a distributed fashion. This function
-        should take 1 input parameter.
+        A module level function to be executed in a distributed fashion. This function
+        should take 1 input parameter, a list of items from uniqueData, and must be
+        picklable (use functools.partial to bind any additional arguments).
 
     uniqueData : [variable]
         Unique data is a list of the data to be passed to the worker function during
-        processing.
+        processing. The list is split into one chunk per worker process.
 
     progressorLabel : str
         The progressor label to be shown on the ArcGIS Pro GP tool. Note: include trailing
         white space in this string if desired.
+
+    Returns
+    -------
+    list of the worker function results, one per chunk
     '''
-    multiprocessing.set_executable(os.path.join(sys.exec_prefix, 'pythonw.exe'))
-    numTracks = len(uniqueData)
-    pool = ThreadPool(processes=numTracks)
-    for indx,rslt in enumerate(pool.imap_unordered(workerFunction,uniqueData)):
-        arcpy.SetProgressorPosition(int(indx/numTracks*100))
-        arcpy.SetProgressorLabel('{} {}/{}...'.format(progressorLabel,indx+1,numTracks))
-    pool.close()
+    if not len(uniqueData):
+        return []
+
+    try:
+        import arcpy
+    except ImportError:
+        arcpy = None #progress is only reported when running inside ArcGIS Pro
+
+    if sys.platform == 'win32': #spawned workers would otherwise open a console window, pythonw only exists on windows
+        set_executable(os.path.join(sys.exec_prefix, 'pythonw.exe'))
+    numWorkers = min(cpu_count(),len(uniqueData))
+    chunks = [[uniqueData[i] for i in part] for part in np.array_split(np.arange(len(uniqueData)),numWorkers)]
+
+    results = []
+    with Pool(processes=numWorkers) as pool:
+        for indx,rslt in enumerate(pool.imap_unordered(workerFunction,chunks,chunksize=1)):
+            results.append(rslt)
+            if arcpy is not None:
+                arcpy.SetProgressorPosition(int((indx+1)/numWorkers*100))
+                arcpy.SetProgressorLabel('{} {}/{}...'.format(progressorLabel,indx+1,numWorkers))
+    return results
 
 def project_as(input_dataframe: pd.DataFrame, output_spatial_reference: int = 4326,
             input_spatial_reference: int = None,
@@ -166,7 +806,7 @@ def project_as(input_dataframe: pd.DataFrame, output_spatial_reference: int = 43
             f'not {type(input_spatial_reference)}.'
 
         if isinstance(input_spatial_reference, int):
-            in_sr = SpatialReference(input_spatial_reference)
+            in_sr = _spatial_reference(input_spatial_reference)
         else:
             in_sr = input_spatial_reference
 
@@ -182,13 +822,17 @@ def project_as(input_dataframe: pd.DataFrame, output_spatial_reference: int = 43
         assert wgs_range, 'Input data for projection data must have a spatial reference, or one must be provided.'
 
         # if the values are in range, run with it
-        in_sr = SpatialReference(4326)
+        in_sr = _spatial_reference(4326)
 
     # ensure the output spatial reference is a SpatialReference object instance
     if isinstance(output_spatial_reference, SpatialReference):
         out_sr = output_spatial_reference
     else:
-        out_sr = SpatialReference(output_spatial_reference)
+        out_sr = _spatial_reference(output_spatial_reference)
+
+    # if the data is already in the output spatial reference there is nothing to project, so skip copying it
+    if in_sr.wkid is not None and in_sr.wkid == out_sr.wkid and transformation_name is None:
+        return input_dataframe
 
     # copy the input spatially enabled dataframe since the project function changes the dataframe in place
     out_df = input_dataframe.copy()
@@ -198,11 +842,18 @@ def project_as(input_dataframe: pd.DataFrame, output_spatial_reference: int = 43
     if transformation_name is None:
 
         # get any necessary transformations using arcpy, which returns only a list of transformation names
-        trns_lst = arcpy.ListTransformations(in_sr.as_arcpy, out_sr.as_arcpy)
+        trns_lst = _list_transformations(in_sr, out_sr)
+
+    # the vertices of points, lines and polygons can be projected in bulk with pyproj, which picks its own datum
+    # transformation, so only do this when no transformation is requested or needed, keeping the results identical
+    # to projecting each geometry
+    if transformation_name is None and not len(trns_lst) and in_sr.wkid != out_sr.wkid and \
+            _can_project_vertices(out_df[geom_col], in_sr, out_sr):
+        out_df[geom_col] = _project_vertices(out_df[geom_col], in_sr, out_sr)
 
     # apply across the geometries using apply since it recognizes the transformation correctly if transformation
     # is necessary and also tries arcpy first, and if not available, rolls back to rest resources elegantly
-    if len(trns_lst) or transformation_name is not None:
+    elif transformation_name is not None or len(trns_lst):
         trns = transformation_name if transformation_name is not None else trns_lst[0]
         out_df[geom_col] = out_df[geom_col].apply(lambda geom: geom.project_as(out_sr, trns))
 
@@ -217,6 +868,138 @@ def project_as(input_dataframe: pd.DataFrame, output_spatial_reference: int = 43
 
     return out_df
 
+@functools.lru_cache(maxsize=256)
+def _spatial_reference(wkid: int) -> SpatialReference:
+    """
+    Get a SpatialReference for a wkid, cached so repeated projections reuse the same object.
+    Args:
+        wkid: Well known id of the spatial reference.
+    Returns: SpatialReference for the wkid.
+    """
+    return SpatialReference(wkid)
+
+@functools.lru_cache(maxsize=256)
+def _list_transformations_by_wkid(in_wkid: int, out_wkid: int) -> tuple:
+    """
+    List the transformations between two spatial references using arcpy, cached by wkid.
+    Args:
+        in_wkid: Well known id of the input spatial reference.
+        out_wkid: Well known id of the output spatial reference.
+    Returns: Tuple of transformation names.
+    """
+    arcpy = _importArcpy()
+    return tuple(arcpy.ListTransformations(_spatial_reference(in_wkid).as_arcpy,
+                                           _spatial_reference(out_wkid).as_arcpy))
+
+def _list_transformations(in_sr: SpatialReference, out_sr: SpatialReference) -> tuple:
+    """
+    List the transformations between two spatial references, reusing earlier results when both have a wkid.
+    Args:
+        in_sr: Input spatial reference.
+        out_sr: Output spatial reference.
+    Returns: Tuple of transformation names, empty if arcpy is not available.
+    """
+    try:
+        arcpy = _importArcpy()
+    except ImportError:
+        return ()
+
+    if in_sr.wkid is None or out_sr.wkid is None:
+        return tuple(arcpy.ListTransformations(in_sr.as_arcpy, out_sr.as_arcpy))
+    return _list_transformations_by_wkid(in_sr.wkid, out_sr.wkid)
+
+# key holding the vertex arrays of each geometry type that can be projected vertex by vertex, curves are left out
+_VERTEX_KEYS = {'point': None, 'polyline': 'paths', 'polygon': 'rings'}
+
+def _can_project_vertices(geometries: pd.Series, in_sr: SpatialReference, out_sr: SpatialReference) -> bool:
+    """
+    Check if a geometry column can be projected in bulk using pyproj.
+    Args:
+        geometries: Geometry column of a Spatially Enabled DataFrame.
+        in_sr: Spatial reference of the geometries.
+        out_sr: Desired output spatial reference.
+    Returns: True if pyproj knows both spatial references and every geometry is a point, or a line or polygon
+        without curves.
+    """
+    if pyproj is None or in_sr.wkid is None or out_sr.wkid is None:
+        return False
+    if _pyproj_transformer(in_sr.wkid, out_sr.wkid) is None:
+        return False
+    for geom in geometries:
+        geom_type = geom.type.lower() if geom is not None else None
+        if geom_type not in _VERTEX_KEYS or (geom_type != 'point' and _VERTEX_KEYS[geom_type] not in geom):
+            return False
+    return True
+
+def _project_vertices(geometries: pd.Series, in_sr: SpatialReference, out_sr: SpatialReference) -> pd.Series:
+    """
+    Project a column of point, line or polygon geometries with a single pyproj transform call over all vertices.
+    Args:
+        geometries: Geometry column of a Spatially Enabled DataFrame.
+        in_sr: Spatial reference of the geometries.
+        out_sr: Desired output spatial reference.
+    Returns: Series of geometries in the output spatial reference.
+    """
+    # gather the vertices of every part, keeping any z or m values to put back unchanged
+    parts = []
+    for geom in geometries:
+        if geom.type.lower() == 'point':
+            parts.append([np.array([[geom['x'], geom['y']]], dtype=np.float64)])
+        else:
+            parts.append([np.asarray(part, dtype=np.float64) for part in geom[_VERTEX_KEYS[geom.type.lower()]]])
+
+    vertices = [part[:, :2] for geom_parts in parts for part in geom_parts]
+    xy = np.concatenate(vertices) if vertices else np.zeros((0, 2))
+    x, y = _pyproj_transformer(in_sr.wkid, out_sr.wkid).transform(xy[:, 0], xy[:, 1])
+
+    out_wkid = {'wkid': out_sr.wkid}
+    out_geoms = []
+    start = 0
+    for geom, geom_parts in zip(geometries, parts):
+        out_parts = []
+        for part in geom_parts:
+            part = part.copy()
+            part[:, 0], part[:, 1] = x[start:start + len(part)], y[start:start + len(part)]
+            out_parts.append(part.tolist())
+            start += len(part)
+
+        if geom.type.lower() == 'point':
+            px, py = out_parts[0][0][:2]
+            out_geoms.append(Geometry(dict(geom, x=px, y=py, spatialReference=out_wkid)))
+        else:
+            out_geoms.append(Geometry(dict(geom, **{_VERTEX_KEYS[geom.type.lower()]: out_parts,
+                                                   'spatialReference': out_wkid})))
+
+    return pd.Series(out_geoms, index=geometries.index)
+
+@functools.lru_cache(maxsize=256)
+def _pyproj_transformer(in_wkid: int, out_wkid: int):
+    """
+    Get a pyproj transformer between two wkids, cached so repeated projections reuse it.
+    Args:
+        in_wkid: Well known id of the input spatial reference.
+        out_wkid: Well known id of the output spatial reference.
+    Returns: pyproj Transformer, or None if pyproj does not know either wkid.
+    """
+    in_crs, out_crs = _pyproj_crs(in_wkid), _pyproj_crs(out_wkid)
+    if in_crs is None or out_crs is None:
+        return None
+    return pyproj.Transformer.from_crs(in_crs, out_crs, always_xy=True)
+
+def _pyproj_crs(wkid: int):
+    """
+    Resolve a wkid to a pyproj CRS, Esri wkids such as 102003 are not EPSG codes.
+    Args:
+        wkid: Well known id of the spatial reference.
+    Returns: pyproj CRS, or None if neither the EPSG nor the ESRI authority defines the wkid.
+    """
+    for authority in ('EPSG', 'ESRI'):
+        try:
+            return pyproj.CRS.from_authority(authority, wkid)
+        except pyproj.exceptions.CRSError:
+            continue
+    return None
+
 def processImagesAsAttachments(detections, image):
     """
     Adds image chips as attachments to the detection featureclass
@@ -229,27 +1012,96 @@ def processImagesAsAttachments(detections, image):
     image : str
         path to source image of detections
     """
+    arcpy = _importArcpy()
     arcpy.EnableAttachments_management(detections) #enable attachments on detections
 
     scratchFolder = arcpy.env.scratchFolder #images will be placed in scratch folder
-    imgDicts = []
     detectionIDField = arcpy.Describe(detections).OIDFieldName
+    imageDesc = arcpy.Describe(image) #workers need the dataset path, a layer name only resolves in this process
 
-    with arcpy.da.SearchCursor(detections,[detectionIDField,'SHAPE@']) as cursor:
-        for row in cursor:
-            img_path = scratchFolder + r"/chip{}.png".format(row[0])
-            arcpy.SetProgressorLabel("Processing {}...".format(row[0]))
-            with arcpy.EnvManager(extent=row[1].extent):
-                arcpy.management.CopyRaster(image, img_path, '', None, "65536", "NONE", "ColormapToRGB", "8_BIT_UNSIGNED", "NONE", "NONE", "PNG", "NONE", "CURRENT_SLICE", "NO_TRANSPOSE")
-            imgDicts.append({'id':row[0],
-                            'path':img_path})
+    #read the detections in the spatial reference of the image so the extents line up with its pixels
+    with arcpy.da.SearchCursor(detections,[detectionIDField,'SHAPE@'],spatial_reference=imageDesc.spatialReference) as cursor:
+        jobs = [(row[0],(row[1].extent.XMin,row[1].extent.YMin,row[1].extent.XMax,row[1].extent.YMax)) for row in cursor]
+
+    worker = functools.partial(_extractImageChips,image=imageDesc.catalogPath,scratchFolder=scratchFolder)
+
+    imgDicts = []
+    for chips in _executeMultiprocessTask(worker,jobs,'Processing chips '):
+        imgDicts.extend(chips)
 
     memTable = r'memory/matchTable'
     imgTable = pd.DataFrame.from_dict(imgDicts)
     imgTable.spatial.to_table(memTable)
 
     arcpy.AddAttachments_management(detections,detectionIDField,memTable,'id','path')
-    
+
+def _extractImageChips(jobs, image, scratchFolder):
+    '''
+    Worker function to distribute image chip extraction across a chunk of detections
+
+    Parameters
+    ----------
+    jobs : list of tuples
+        (detection id, (xmin, ymin, xmax, ymax)) of each chip in the spatial reference of the image
+
+    image : str
+        path to source image of detections
+
+    scratchFolder : str
+        folder the chips are written to
+
+    Returns
+    -------
+    list of dicts with the detection id and the path of its chip
+    '''
+    arcpy = _importArcpy()
+    src = arcpy.Raster(image) #open the source once per worker, each chip only reads its own window
+
+    imgDicts = []
+    for oid, bounds in jobs:
+        img_path = scratchFolder + r"/chip{}.png".format(oid)
+        _getImageChip(src,arcpy.Extent(*bounds)).save(img_path)
+        imgDicts.append({'id':oid,
+                        'path':img_path})
+    return imgDicts
+
+def _getImageChip(raster, extent, eightBit=True):
+    '''
+    Reads the window of a raster covered by an extent as an image
+
+    Parameters
+    ----------
+    raster : arcpy Raster
+        source image, opened once by the caller
+
+    extent : arcpy Extent
+        extent of the chip in the spatial reference of the raster
+
+    eightBit : bool
+        clip the chip to 8 bit RGB as the attachments are written, otherwise the pixel depth and
+        bands are kept as read, which only works for rasters passing _canEncodeChip
+
+    Returns
+    -------
+    PIL Image of the chip
+    '''
+    arcpy = _importArcpy()
+    Image = _importPIL()
+    ncols = max(1,int(round(extent.width/raster.meanCellWidth)))
+    nrows = max(1,int(round(extent.height/raster.meanCellHeight)))
+    arr = arcpy.RasterToNumPyArray(raster,arcpy.Point(extent.XMin,extent.YMin),ncols,nrows,nodata_to_value=0)
+
+    if not eightBit: #single band 16 bit chips become PIL I;16 images, which PNG stores at full depth
+        return Image.fromarray(np.moveaxis(arr,0,-1) if arr.ndim == 3 else arr)
+    if arr.ndim == 3: #multiband rasters are read bands first, PNG holds at most RGB bands last
+        arr = np.moveaxis(arr[:3],0,-1)
+    return Image.fromarray(np.clip(arr,0,255).astype(np.uint8))
+
+def _canEncodeChip(raster):
+    '''Checks if PIL can write the chips of a raster as PNG without changing their pixel depth or bands'''
+    if raster.pixelType in ('U1','U2','U4','U8'):
+        return raster.bandCount <= 4
+    return raster.pixelType == 'U16' and raster.bandCount == 1
 
 def processBlobImages(detections,image):
     """
@@ -262,17 +1114,90 @@ def processBlobImages(detections,image):
 
     image : str
         path to source image of detections"""
-    temp_img = os.path.join(os.path.dirname(arcpy.env.scratchWorkspace),'temp_img.png')
+    arcpy = _importArcpy()
 
     #Idea by Andrew King: aking@esri.com
     arcpy.AddField_management(detections,'image',"BLOB")
 
-    with arcpy.da.UpdateCursor(detections,['OID@','image','SHAPE@']) as cursor:
+    src = arcpy.Raster(image) #open the source once, each chip only reads its own window
+    encodeInMemory = _canEncodeChip(src) #other pixel depths keep the CopyRaster round trip so they are not clipped
+    tempImg = os.path.join(arcpy.env.scratchFolder,'temp_img.png')
+
+    #read the detections in the spatial reference of the image so the extents line up with its pixels, the
+    #update cursor never touches the geometry so the detections are not written back reprojected
+    with arcpy.da.SearchCursor(detections,['OID@','SHAPE@'],spatial_reference=src.spatialReference) as cursor:
+        extents = {oid:shape.extent for oid, shape in cursor}
+
+    with arcpy.da.UpdateCursor(detections,['OID@','image']) as cursor:
         for row in cursor:
             arcpy.SetProgressorLabel("Processing {}...".format(row[0]))
-            arcpy.env.extent = row[2].extent
-            arcpy.CopyRaster_management(image,temp_img)
-            row[1] = open(temp_img,'rb').read()
+            if encodeInMemory:
+                buf = io.BytesIO() #encode the chip in memory rather than round tripping through a temp file
+                _getImageChip(src,extents[row[0]],eightBit=False).save(buf,format='PNG')
+                row[1] = buf.getvalue()
+            else:
+                with arcpy.EnvManager(extent=extents[row[0]]):
+                    arcpy.CopyRaster_management(image,tempImg)
+                with open(tempImg,'rb') as f:
+                    row[1] = f.read()
+                os.remove(tempImg)
             cursor.updateRow(row)
-            os.remove(temp_img)
     return detections
+
+def _importArcpy():
+    '''
+    Imports arcpy on first use so the module loads, and spaceTimeMatch runs on GeoParquet
+    inputs, without ArcGIS Pro or a license
+
+    Returns
+    -------
+    arcpy module
+    '''
+    try:
+        import arcpy
+    except ImportError as e:
+        raise ImportError('arcpy is required to work with featureclasses and rasters. Run this from the ArcGIS Pro '
+                          'python environment, or pass GeoParquet files to spaceTimeMatch.') from e
+    return arcpy
+
+def _importPIL():
+    '''
+    Imports Pillow on first use, it is only needed to encode image chips
+
+    Returns
+    -------
+    PIL Image module
+    '''
+    try:
+        from PIL import Image
+    except ImportError as e:
+        raise ImportError('Pillow is required to write image chips. Install it with "pip install Pillow".') from e
+    return Image
+
+def _isGeoParquet(path):
+    '''Checks if an input path is a GeoParquet file rather than a featureclass'''
+    return str(path).lower().endswith('.parquet')
+
+def _readGeoParquet(path, wkid=None):
+    '''
+    Reads a GeoParquet file with geopandas
+
+    Parameters
+    ----------
+    path : str
+        path to the GeoParquet file
+
+    wkid : int
+        well known id of the spatial reference to project the features to, the features are not
+        projected if None
+
+    Returns
+    -------
+    geopandas GeoDataFrame
+    '''
+    try:
+        import geopandas as gpd
+    except ImportError as e:
+        raise ImportError('geopandas is required to read GeoParquet inputs.') from e
+    gdf = gpd.read_parquet(path)
+    return gdf if wkid is None else gdf.to_crs(epsg=wkid)
@@ -10,6 +10,14 @@ setuptools.setup(
     author_email="phornstein@esri.com",
     description="This package is a demo package of how a python toolbox can be included in your python distribution.",
     install_requires=[],
+    extras_require={
+        #GeoParquet inputs for spaceTimeMatch, which then runs without ArcGIS Pro
+        'geoparquet':['geopandas','pyarrow'],
+        #writing image chips
+        'chips':['Pillow'],
+        #vectorized matching and projection, slower fallbacks are used without them
+        'fast':['shapely>=2','numba','pyproj'],
+    },
     long_description=long_description,
     long_description_content_type="text/markdown",
     url="https://github.com/phornstein/Object-Detection-Tools",